@@ -84,15 +84,23 @@ def load(config):
 
     elif config.dataset_name == "synthetic":
         dataset, labels = load_place_cells()
-        dataset = np.log(dataset.astype(np.float32) + 1)
+        dataset = np.log(dataset + 1)
         dataset = (dataset - np.min(dataset)) / (np.max(dataset) - np.min(dataset))
     elif config.dataset_name == "images":
-        dataset, labels = load_images(img_size=config.img_size)
+        dataset, labels = load_images(
+            img_size=config.img_size,
+            device=config.device,
+            cache_dir=getattr(config, "dataset_cache_dir", None),
+        )
         dataset = (dataset - np.min(dataset)) / (np.max(dataset) - np.min(dataset))
         height, width = dataset.shape[1:3]
         dataset = dataset.reshape((-1, height * width))
     elif config.dataset_name == "projected_images":
-        dataset, labels = load_projected_images(img_size=config.img_size)
+        dataset, labels = load_projected_images(
+            img_size=config.img_size,
+            device=config.device,
+            cache_dir=getattr(config, "dataset_cache_dir", None),
+        )
         dataset = (dataset - np.min(dataset)) / (np.max(dataset) - np.min(dataset))
     elif config.dataset_name == "points":
         dataset, labels = load_points()
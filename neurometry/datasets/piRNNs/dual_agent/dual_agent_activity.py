@@ -50,6 +50,7 @@ def main(options, file_path, epoch="final", res=20):
             n_avg=n_avg,
             Ng=Ng,
             all_activations_flag=True,
+            return_traces=True,
         )
     )
 
@@ -1,5 +1,6 @@
 import cv2
 import numpy as np
+import torch
 from imageio import imsave
 from matplotlib import pyplot as plt
 from tqdm import tqdm
@@ -7,45 +8,26 @@ from tqdm import tqdm
 
 def concat_images(images, image_width, spacer_size):
     """Concat image horizontally with spacer"""
-    spacer = np.ones([image_width, spacer_size, 4], dtype=np.uint8) * 255
-    images_with_spacers = []
-
-    image_size = len(images)
-
-    for i in range(image_size):
-        images_with_spacers.append(images[i])
-        if i != image_size - 1:
-            # Add spacer
-            images_with_spacers.append(spacer)
-    return np.hstack(images_with_spacers)
+    return concat_images_in_rows(images, 1, image_width, spacer_size)
 
 
 def concat_images_in_rows(images, row_size, image_width, spacer_size=4):
     """Concat images in rows"""
     column_size = len(images) // row_size
-    spacer_h = (
-        np.ones(
-            [
-                spacer_size,
-                image_width * column_size + (column_size - 1) * spacer_size,
-                4,
-            ],
-            dtype=np.uint8,
-        )
-        * 255
+    step = image_width + spacer_size
+    # Copy the images into a single white canvas, the gaps being the spacers.
+    canvas = np.full(
+        [row_size * step - spacer_size, column_size * step - spacer_size, 4],
+        255,
+        dtype=np.uint8,
     )
-
-    row_images_with_spacers = []
-
-    for row in range(row_size):
-        row_images = images[column_size * row : column_size * row + column_size]
-        row_concated_images = concat_images(row_images, image_width, spacer_size)
-        row_images_with_spacers.append(row_concated_images)
-
-        if row != row_size - 1:
-            row_images_with_spacers.append(spacer_h)
-
-    return np.vstack(row_images_with_spacers)
+    for i, image in enumerate(images[: row_size * column_size]):
+        row, column = divmod(i, column_size)
+        canvas[
+            row * step : row * step + image_width,
+            column * step : column * step + image_width,
+        ] = image
+    return canvas
 
 
 def convert_to_colormap(im, cmap):
@@ -53,21 +35,108 @@ def convert_to_colormap(im, cmap):
     return np.uint8(im * 255)
 
 
-def rgb(im, cmap="jet", smooth=True):
-    cmap = plt.cm.get_cmap(cmap)
+def _colormap_lut(cmap):
+    """Return the RGBA colors of a colormap as uint8 lookup tables.
+
+    Parameters
+    ----------
+    cmap : str
+        Name of the matplotlib colormap.
+
+    Returns
+    -------
+    lut : array-like, shape=[n_colors, 4]
+        Colors of the colormap, indexed by the quantized values.
+    bad_color : array-like, shape=[4,]
+        Color of the NaN values.
+    """
+    cmap = plt.get_cmap(cmap)
+    lut = np.uint8(cmap(np.arange(cmap.N)) * 255)
+    bad_color = np.uint8(np.array(cmap(np.nan)) * 255)
+    return lut, bad_color
+
+
+def _rgb(images, lut, bad_color, smooth=True):
+    """Normalize, smooth and color a stack of images with a lookup table.
+
+    Parameters
+    ----------
+    images : array-like, shape=[n_images, height, width]
+        Images, each normalized by its own range.
+    lut : array-like, shape=[n_colors, 4]
+        Colors of the colormap, indexed by the quantized values.
+    bad_color : array-like, shape=[4,]
+        Color of the NaN values.
+    smooth : bool
+        Whether to smooth the images with a gaussian blur.
+
+    Returns
+    -------
+    colors : array-like, shape=[n_images, height, width, 4]
+        RGBA images.
+    """
     np.seterr(invalid="ignore")  # ignore divide by zero err
-    im = (im - np.min(im)) / (np.max(im) - np.min(im))
+    images = images - np.min(images, axis=(-2, -1), keepdims=True)
+    # Out of place, so that integer images are promoted to floats.
+    images = images / np.max(images, axis=(-2, -1), keepdims=True)
     if smooth:
-        im = cv2.GaussianBlur(im, (3, 3), sigmaX=1, sigmaY=0)
-    im = cmap(im)
-    return np.uint8(im * 255)
+        for image in images:
+            image[...] = cv2.GaussianBlur(image, (3, 3), sigmaX=1, sigmaY=0)
+    nan = np.isnan(images)
+    # Quantize as matplotlib's colormaps do, with 1 mapped to the last color.
+    images *= len(lut)
+    colors = np.take(lut, np.clip(images.astype(int), 0, len(lut) - 1), axis=0)
+    colors[nan] = bad_color
+    return colors
+
+
+def rgb(im, cmap="jet", smooth=True):
+    return _rgb(im[None], *_colormap_lut(cmap), smooth)[0]
 
 
 def plot_ratemaps(activations, n_plots, cmap="jet", smooth=True, width=16):
-    images = [rgb(im, cmap, smooth) for im in activations[:n_plots]]
+    images = _rgb(activations[:n_plots], *_colormap_lut(cmap), smooth)
     return concat_images_in_rows(images, n_plots // width, activations.shape[-1])
 
 
+def _bin_activations(x_bins, y_bins, g_batch, res):
+    """Sum the activations of a batch over the bins of the position grid.
+
+    Parameters
+    ----------
+    x_bins, y_bins : torch.Tensor, shape=[n_samples,]
+        Integer (long) bin indices of the positions of the samples. Samples
+        outside of the grid are ignored.
+    g_batch : torch.Tensor, shape=[n_samples, Ng]
+        Activations of the samples, on the same device as the bins.
+    res : int
+        Number of bins along each axis of the grid.
+
+    Returns
+    -------
+    counts : torch.Tensor, shape=[res, res]
+        Number of samples in each bin, in float64.
+    activations : torch.Tensor, shape=[Ng, res, res]
+        Sum of the activations of the samples in each bin, in float64.
+    """
+    n_neurons = g_batch.shape[1]
+    in_box = (x_bins >= 0) & (x_bins < res) & (y_bins >= 0) & (y_bins < res)
+    # The samples outside of the box go to an extra overflow bin, sliced off
+    # below: unlike boolean masks and bincount, this does not synchronize
+    # with the device, so the copies of the traces can overlap with it.
+    bins = torch.where(in_box, x_bins * res + y_bins, res * res)
+
+    counts = torch.zeros(res * res + 1, dtype=torch.float64, device=g_batch.device)
+    counts.index_add_(0, bins, torch.ones_like(bins, dtype=torch.float64))
+    counts = counts[:-1].reshape(res, res)
+    # Each sample adds its contiguous row of activations to its bin's row.
+    activations = torch.zeros(
+        [res * res + 1, n_neurons], dtype=torch.float64, device=g_batch.device
+    )
+    activations.index_add_(0, bins, g_batch.to(torch.float64))
+    return counts, activations[:-1].T.reshape(n_neurons, res, res)
+
+
 def compute_ratemaps(
     model,
     trajectory_generator,
@@ -77,119 +146,168 @@ def compute_ratemaps(
     Ng=512,
     idxs=None,
     all_activations_flag=False,
+    return_traces=False,
 ):
-    """Compute spatial firing fields"""
+    """Compute spatial firing fields
+
+    The activations and positions of all samples, g and pos, are only
+    kept and returned if return_traces is set; otherwise they are None.
+    """
 
     if not n_avg:
         n_avg = 1000 // options.sequence_length
 
     if not np.any(idxs):
         idxs = np.arange(Ng)
-    idxs = idxs[:Ng]
-
-    g = np.zeros([n_avg, options.batch_size * options.sequence_length, Ng])
-    pos = np.zeros([n_avg, options.batch_size * options.sequence_length, 2])
+    idxs = torch.as_tensor(idxs[:Ng], device=options.device)
+    device = options.device
+
+    g = pos = None
+    if return_traces:
+        # On GPU, the traces are copied asynchronously into pinned buffers,
+        # overlapping with the generation of the next batches.
+        pin_memory = torch.device(device).type == "cuda"
+        n_samples = options.batch_size * options.sequence_length
+        g = torch.empty(
+            [n_avg, n_samples, Ng], dtype=torch.float32, pin_memory=pin_memory
+        )
+        pos = torch.empty(
+            [n_avg, n_samples, 2], dtype=torch.float32, pin_memory=pin_memory
+        )
 
-    activations = np.zeros([Ng, res, res])
-    all_activations = np.zeros([Ng, res, res, n_avg])
-    counts = np.zeros([res, res])
+    # The rate maps are accumulated on the device of the trajectories, so
+    # that only the binned activations are copied back.
+    activations = torch.zeros([Ng, res, res], dtype=torch.float64, device=device)
+    if all_activations_flag:
+        # The summed activations of each batch, kept in float32 to halve
+        # the memory of this [Ng, res, res, n_avg] array.
+        all_activations = torch.zeros(
+            [Ng, res, res, n_avg], dtype=torch.float32, device=device
+        )
+    counts = torch.zeros([res, res], dtype=torch.float64, device=device)
+    x_scale = res / options.box_width
+    y_scale = res / options.box_height
 
-    # model = model.double()
     model.eval()
+    # The trajectories are generated in float32: only cast them if the
+    # model was converted to another dtype.
+    dtype = next(model.parameters()).dtype
 
     for index in tqdm(range(n_avg), desc="Processing"):
         inputs, pos_batch, _ = trajectory_generator.get_test_batch()
-        inputs = (inputs[0].double(), inputs[1].double())
-        g_batch = model.g(inputs).detach().cpu().numpy()
+        inputs = (inputs[0].to(dtype), inputs[1].to(dtype))
+        g_batch = model.g(inputs).detach()
 
-        pos_batch = pos_batch[:, :, :2]
-        pos_batch = np.reshape(pos_batch.cpu(), [-1, 2])
+        pos_batch = pos_batch[:, :, :2].reshape(-1, 2)
         g_batch = g_batch[:, :, idxs].reshape(-1, Ng)
 
-        g[index] = g_batch
-        pos[index] = pos_batch
+        if return_traces:
+            g[index].copy_(g_batch, non_blocking=True)
+            pos[index].copy_(pos_batch, non_blocking=True)
 
-        x_batch = (pos_batch[:, 0] + options.box_width / 2) / (options.box_width) * res
-        y_batch = (
-            (pos_batch[:, 1] + options.box_height / 2) / (options.box_height) * res
-        )
+        x_bins = torch.floor((pos_batch[:, 0] + options.box_width / 2) * x_scale)
+        y_bins = torch.floor((pos_batch[:, 1] + options.box_height / 2) * y_scale)
 
-        for i in range(options.batch_size * options.sequence_length):
-            x = x_batch[i]
-            y = y_batch[i]
-            if x >= 0 and x < res and y >= 0 and y < res:
-                counts[int(x), int(y)] += 1
-                activations[:, int(x), int(y)] += g_batch[i, :]
+        batch_counts, batch_activations = _bin_activations(
+            x_bins.long(), y_bins.long(), g_batch, res
+        )
+        counts += batch_counts
+        activations += batch_activations
 
-                if all_activations_flag:
-                    all_activations[:, int(x), int(y), index] += g_batch[i, :]
+        if all_activations_flag:
+            all_activations[..., index] = batch_activations
 
-    for x in range(res):
-        for y in range(res):
-            if counts[x, y] > 0:
-                activations[:, x, y] /= counts[x, y]
+    visited = counts > 0
+    activations[:, visited] /= counts[visited]
+    activations = activations.cpu().numpy()
 
-    g = g.reshape([-1, Ng])
-    pos = pos.reshape([-1, 2])
+    if return_traces:
+        if pin_memory:
+            torch.cuda.synchronize(device)
+        g = g.reshape([-1, Ng]).numpy()
+        pos = pos.reshape([-1, 2]).numpy()
 
     # # scipy binned_statistic_2d is slightly slower
     # activations = scipy.stats.binned_statistic_2d(pos[:,0], pos[:,1], g.T, bins=res)[0]
     rate_map = activations.reshape(Ng, -1)
 
     if all_activations_flag:
-        activations = all_activations
+        activations = all_activations.cpu().numpy()
 
     return activations, rate_map, g, pos
 
 
 def compute_ratemaps_single_agent(
-    model, trajectory_generator, options, res=20, n_avg=None, Ng=512, idxs=None
+    model,
+    trajectory_generator,
+    options,
+    res=20,
+    n_avg=None,
+    Ng=512,
+    idxs=None,
+    return_traces=False,
 ):
-    """Compute spatial firing fields"""
+    """Compute spatial firing fields
+
+    The activations and positions of all samples, g and pos, are only
+    kept and returned if return_traces is set; otherwise they are None.
+    """
 
     if not n_avg:
         n_avg = 1000 // options.sequence_length
 
     if not np.any(idxs):
         idxs = np.arange(Ng)
-    idxs = idxs[:Ng]
-
-    g = np.zeros([n_avg, options.batch_size * options.sequence_length, Ng])
-    pos = np.zeros([n_avg, options.batch_size * options.sequence_length, 2])
+    idxs = torch.as_tensor(idxs[:Ng], device=options.device)
+    device = options.device
+
+    g = pos = None
+    if return_traces:
+        # On GPU, the traces are copied asynchronously into pinned buffers,
+        # overlapping with the generation of the next batches.
+        pin_memory = torch.device(device).type == "cuda"
+        n_samples = options.batch_size * options.sequence_length
+        g = torch.empty(
+            [n_avg, n_samples, Ng], dtype=torch.float32, pin_memory=pin_memory
+        )
+        pos = torch.empty(
+            [n_avg, n_samples, 2], dtype=torch.float32, pin_memory=pin_memory
+        )
 
-    activations = np.zeros([Ng, res, res])
-    counts = np.zeros([res, res])
+    activations = torch.zeros([Ng, res, res], dtype=torch.float64, device=device)
+    counts = torch.zeros([res, res], dtype=torch.float64, device=device)
+    x_scale = res / options.box_width
+    y_scale = res / options.box_height
 
     for index in range(n_avg):
         inputs, pos_batch, _ = trajectory_generator.get_test_batch_single_agent()
-        g_batch = model.g(inputs).detach().cpu().numpy()
+        g_batch = model.g(inputs).detach()
 
-        pos_batch = pos_batch[:, :, :2]
-        pos_batch = np.reshape(pos_batch.cpu(), [-1, 2])
+        pos_batch = pos_batch[:, :, :2].reshape(-1, 2)
         g_batch = g_batch[:, :, idxs].reshape(-1, Ng)
 
-        g[index] = g_batch
-        pos[index] = pos_batch
+        if return_traces:
+            g[index].copy_(g_batch, non_blocking=True)
+            pos[index].copy_(pos_batch, non_blocking=True)
 
-        x_batch = (pos_batch[:, 0] + options.box_width / 2) / (options.box_width) * res
-        y_batch = (
-            (pos_batch[:, 1] + options.box_height / 2) / (options.box_height) * res
-        )
-
-        for i in range(options.batch_size * options.sequence_length):
-            x = x_batch[i]
-            y = y_batch[i]
-            if x >= 0 and x < res and y >= 0 and y < res:
-                counts[int(x), int(y)] += 1
-                activations[:, int(x), int(y)] += g_batch[i, :]
+        x_bins = torch.floor((pos_batch[:, 0] + options.box_width / 2) * x_scale)
+        y_bins = torch.floor((pos_batch[:, 1] + options.box_height / 2) * y_scale)
 
-    for x in range(res):
-        for y in range(res):
-            if counts[x, y] > 0:
-                activations[:, x, y] /= counts[x, y]
-
-    g = g.reshape([-1, Ng])
-    pos = pos.reshape([-1, 2])
+        batch_counts, batch_activations = _bin_activations(
+            x_bins.long(), y_bins.long(), g_batch, res
+        )
+        counts += batch_counts
+        activations += batch_activations
+
+    visited = counts > 0
+    activations[:, visited] /= counts[visited]
+    activations = activations.cpu().numpy()
+
+    if return_traces:
+        if pin_memory:
+            torch.cuda.synchronize(device)
+        g = g.reshape([-1, Ng]).numpy()
+        pos = pos.reshape([-1, 2]).numpy()
 
     # # scipy binned_statistic_2d is slightly slower
     # activations = scipy.stats.binned_statistic_2d(pos[:,0], pos[:,1], g.T, bins=res)[0]
@@ -45,6 +45,11 @@ class Experiment:
         )
         self.eval_iter = iter(eval_dataset)
 
+        # positions of the fixed point condition check, built once on device
+        xs = torch.arange(40, dtype=torch.float32, device=device)
+        self.fixed_x = torch.cartesian_prod(xs, xs)
+        self.fixed_dx = torch.zeros((40, 2), device=device)
+
         # initialize optimizer
         logging.info("==== initialize optimizer ====")
         if config.train.optimizer_type == "adam":
@@ -101,7 +106,9 @@ class Experiment:
         )
         hooks += [report_progress]
 
-        train_metrics = []
+        # running sums of the train metrics on device, averaged when logged
+        train_metrics = {}
+        num_train_steps = 0
         block_size = self.model_config.block_size
         num_grid = self.model_config.num_grid
         num_block = self.model_config.num_neurons // block_size
@@ -147,19 +154,17 @@ class Experiment:
                 self.model.trans.b.data = self.model.trans.b.data.abs()
 
                 if config.norm_v:
+                    # normalize each block of v in place, through a view
                     with torch.no_grad():
-                        v = self.model.encoder.v.data.reshape(
+                        v = self.model.encoder.v.view(
                             (-1, block_size, num_grid, num_grid)
                         )
-                        v_normed = nn.functional.normalize(v, dim=1) / np.sqrt(
-                            num_block
-                        )
-                        self.model.encoder.v.data = v_normed.reshape(
-                            (-1, num_grid, num_grid)
-                        )
+                        v_norm = v.norm(dim=1, keepdim=True).clamp_(min=1e-12)
+                        v.div_(v_norm.mul_(np.sqrt(num_block)))
 
-                metrics_step = utils.dict_to_numpy(metrics_step)
-                train_metrics.append(metrics_step)
+                for key, value in metrics_step.items():
+                    train_metrics[key] = train_metrics.get(key, 0.0) + value.detach()
+                num_train_steps += 1
 
                 # Quick indication that training is happening.
                 logging.log_first_n(
@@ -169,11 +174,16 @@ class Experiment:
                 #     h(step)
 
                 if step % config.steps_per_logging == 0 or step == 1:
-                    train_metrics = utils.average_appended_metrics(train_metrics)
+                    # a single device to host copy for all the metrics
+                    mean_metrics = (
+                        torch.stack(list(train_metrics.values())) / num_train_steps
+                    ).tolist()
                     wandb.log(
-                        {key: value for key, value in train_metrics.items()}, step=step
+                        dict(zip(train_metrics.keys(), mean_metrics, strict=True)),
+                        step=step,
                     )
-                    train_metrics = []
+                    train_metrics = {}
+                    num_train_steps = 0
 
                 if (
                     step == self.starting_step
@@ -188,48 +198,37 @@ class Experiment:
                         x_eval = torch.rand((3, 2)) * num_grid - 0.5
                         x_eval = x_eval.to(self.device)
                         v_x_eval = self.model.encoder(x_eval)
-                        x_pred, heatmaps, _ = self.model.decoder.decode(v_x_eval)
+                        x_pred, _, _ = self.model.decoder.decode(v_x_eval)
 
                         # add fixed point condidtion check
-                        x1 = torch.arange(0, 40, 1).repeat_interleave(40)
-                        x2 = torch.arange(0, 40, 1).repeat(40)
-                        x1 = torch.unsqueeze(x1, 1)
-                        x2 = torch.unsqueeze(x2, 1)
-                        x = torch.cat((x1, x2), axis=1)
-
                         error_fixed = 0.0
                         error_fixed_zero = 0.0
                         loss = nn.MSELoss()
 
-                        for i in range(40):
-                            start = i * 40
-                            end = start + 40
-                            input = x[start:end,]
-                            v_x = self.model.encoder(input.to(self.device))
-                            trans_v_x = self.model.trans(
-                                v_x, torch.zeros((40, 2)).to(self.device)
-                            )
+                        # Decode in chunks of 40 positions: decode builds a
+                        # [num_traj, num_grid, num_grid, num_neurons] tensor.
+                        for input in self.fixed_x.split(40):
+                            v_x = self.model.encoder(input)
+                            trans_v_x = self.model.trans(v_x, self.fixed_dx)
                             x_t, _, _ = self.model.decoder.decode(trans_v_x)
                             x_t_zero, _, _ = self.model.decoder.decode(v_x)
-                            error_fixed += loss(
-                                input.float().to(self.device), x_t.float()
-                            )
-                            error_fixed_zero += loss(
-                                input.float().to(self.device), x_t_zero.float()
-                            )
+                            error_fixed += loss(input, x_t.float())
+                            error_fixed_zero += loss(input, x_t_zero.float())
 
                         error_fixed = error_fixed / 40
                         error_fixed_zero = error_fixed_zero / 40
 
-                        heatmaps = heatmaps.cpu().detach().numpy()[None, ...]
-
                         err = torch.mean(torch.sum((x_eval - x_pred) ** 2, dim=-1))
 
+                        # a single device to host copy for the three errors
+                        err, error_fixed, error_fixed_zero = torch.stack(
+                            [err, error_fixed, error_fixed_zero]
+                        ).tolist()
                         wandb.log(
                             {
-                                "pred_x": err.item(),
-                                "error_fixed": error_fixed.item(),
-                                "error_fixed_zero": error_fixed_zero.item(),
+                                "pred_x": err,
+                                "error_fixed": error_fixed,
+                                "error_fixed_zero": error_fixed_zero,
                             },
                             step=step,
                         )
@@ -312,40 +311,18 @@ class Experiment:
 
         scorer = GridScorer(40, ((0, 1), (0, 1)), masks_parameters)
 
-        score_list = np.zeros(shape=[len(weights)], dtype=np.float32)
-        scale_list = np.zeros(shape=[len(weights)], dtype=np.float32)
         # orientation_list = np.zeros(shape=[len(weights)], dtype=np.float32)
-        sac_list = []
         # plt.figure(figsize=(int(ncol * 1.6), int(nrow * 1.6)))
 
-        for i in range(len(weights)):
-            rate_map = weights[i]
-            rate_map = (rate_map - rate_map.min()) / (rate_map.max() - rate_map.min())
-            """
-      score, autocorr_ori, autocorr, scale, orientation, peaks = \
-          gridnessScore(rateMap=rate_map, arenaDiam=1, h=1.0 /
-                        (num_interval-1), corr_cutRmin=0.3)
-      if (i > 64 and i < 74) or (i > 74 and i < 77) or (i > 77 and i < 89) or (i > 89 and i < 92) or (i > 92 and i < 96):
-        peaks = peaks0
-      else:
-        peaks0 = peaks
-      """
-            score_60, score_90, max_60_mask, max_90_mask, sac = scorer.get_scores(
-                weights[i]
-            )
-            sac_list.append(sac)
-
-            score_list[i] = score_60
-            # scale_list[i] = scale
-            scale_list[i] = max_60_mask[1]
-            # orientation_list[i] = orientation
-
-        scale_tensor = torch.from_numpy(scale_list)
-        score_tensor = torch.from_numpy(score_list)
-        max_scale = torch.max(scale_tensor[score_list > 0.37])
+        # Score all the rate maps at once.
+        scores_60, _, max_60_masks, _, _, _ = scorer.get_scores_batch(weights)
+        score_tensor = torch.as_tensor(scores_60, dtype=torch.float32)
+        scale_tensor = torch.tensor(
+            [mask[1] for mask in max_60_masks], dtype=torch.float32
+        )
+        max_scale = torch.max(scale_tensor[score_tensor > 0.37])
 
-        scale_tensor = scale_tensor.reshape((num_block, block_size))
-        scale_tensor = torch.mean(scale_tensor, dim=1)
+        scale_tensor = torch.mean(scale_tensor.view(num_block, block_size), dim=1)
 
         # score_tensor = score_tensor.reshape((num_block, block_size))
         score_tensor = torch.mean(score_tensor)
@@ -179,6 +179,10 @@ class GridCell(nn.Module):
 
         loss_transform = torch.zeros([]).to(traj.get_device())
 
+        saliency_kernel = self._saliency_kernel(
+            x_grid.to(traj.device), config.saliency_type
+        ).unsqueeze(0)  # (1, 1600)
+
         v_x = self.encoder(traj[:, 0, :])
         for i in range(traj.shape[1] - 1):
             dist = torch.sum(
@@ -203,11 +207,6 @@ class GridCell(nn.Module):
             )  # (num_traj, 1600)
             y_hat = heatmap_reshape  # actual "place cell" activity over the grid (linear readout of grid cells)
 
-            saliency_kernel = (
-                self._saliency_kernel(x_grid, config.saliency_type)
-                .unsqueeze(0)
-                .to(traj.device)
-            )  # (1, 1600)
             if step < config.reward_step:
                 L_error = (y - y_hat) ** 2
             else:
@@ -1,12 +1,6 @@
-import numpy as np
 import torch
 
 
-def average_appended_metrics(metrics):
-    ks = metrics[0].keys()
-    return {k: np.mean([metrics[i][k] for i in range(len(metrics))]) for k in ks}
-
-
 def dict_to_numpy(data):
     for key, value in data.items():
         if isinstance(value, dict):
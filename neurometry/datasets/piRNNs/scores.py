@@ -16,6 +16,8 @@
 """Grid score calculations."""
 
 import math
+import os
+from concurrent.futures import ThreadPoolExecutor
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -145,6 +147,51 @@ class GridScorer:
         x_coef = np.real(x_coef)
         return np.nan_to_num(x_coef)
 
+    def calculate_sacs(self, rate_maps):
+        """Calculating spatial autocorrelograms of a stack of ratemaps.
+
+        Batched version of calculate_sac, where the correlations are
+        computed with FFTs along the last two axes.
+        """
+        # As in calculate_sac, NaNs are zeroed before the masks of the valid
+        # bins are computed, so that all bins count.
+        seqs = np.nan_to_num(np.asarray(rate_maps, dtype=float))
+        # The coefficients do not depend on the offset of the maps: center
+        # them, so that the FFTs do not lose the variations to the offset.
+        seqs = seqs - seqs.mean(axis=(-2, -1), keepdims=True)
+        ones_seqs = np.ones(seqs.shape)
+        shape = [2 * n - 1 for n in seqs.shape[-2:]]
+
+        def fft2(x):
+            return np.fft.rfft2(x, shape, axes=(-2, -1))
+
+        def rot_fft2(x):
+            return fft2(np.rot90(x, 2, axes=(-2, -1)))
+
+        def filter2(fft_b, fft_x):
+            return np.fft.irfft2(fft_b * fft_x, shape, axes=(-2, -1))
+
+        fft_seqs, rot_fft_seqs = fft2(seqs), rot_fft2(seqs)
+        fft_ones, rot_fft_ones = fft2(ones_seqs), rot_fft2(ones_seqs)
+
+        seq1_x_seq2 = filter2(rot_fft_seqs, fft_seqs)
+        sum_seq1 = filter2(rot_fft_seqs, fft_ones)
+        sum_seq2 = filter2(rot_fft_ones, fft_seqs)
+        sum_seq1_sq = filter2(rot_fft2(np.square(seqs)), fft_ones)
+        sum_seq2_sq = filter2(rot_fft_ones, fft2(np.square(seqs)))
+        # The overlaps are counts of bins: remove the rounding errors of the
+        # FFTs so that single bin overlaps have a zero variance.
+        n_bins = np.rint(filter2(rot_fft_ones, fft_ones))
+        n_bins_sq = np.square(n_bins)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            std_seq1 = np.sqrt(sum_seq1_sq / n_bins - np.square(sum_seq1) / n_bins_sq)
+            std_seq2 = np.sqrt(sum_seq2_sq / n_bins - np.square(sum_seq2) / n_bins_sq)
+            covar = seq1_x_seq2 / n_bins - sum_seq1 * sum_seq2 / n_bins_sq
+            x_coef = covar / (std_seq1 * std_seq2)
+        x_coef[n_bins < 2] = 0.0
+        return np.nan_to_num(x_coef)
+
     def rotated_sacs(self, sac, angles):
         return [
             scipy.ndimage.interpolation.rotate(sac, angle, reshape=False)
@@ -191,6 +238,75 @@ class GridScorer:
             max_60_ind,
         )
 
+    def get_scores_batch(self, rate_maps):
+        """Get summary of scores for a stack of ratemaps.
+
+        Batched version of get_scores: the values are stacked along the
+        first axis, and the mask parameters are returned as lists.
+        """
+        sacs = self.calculate_sacs(rate_maps)
+        n_maps = len(sacs)
+        flat_sacs = sacs.reshape(n_maps, -1)
+
+        # The masks are binary: the sums over the masks of the centered
+        # sacs are expanded into matrix products with the stacked masks.
+        masks = np.stack([mask for mask, _ in self._masks]).reshape(
+            len(self._masks), -1
+        )
+        ring_areas = np.sum(masks, axis=1)
+        sums = flat_sacs @ masks.T
+        masked_sac_means = sums / ring_areas
+        variances = (
+            np.square(flat_sacs) @ masks.T / ring_areas
+            - np.square(masked_sac_means)
+            + 1e-5
+        )
+
+        def correlate(angle):
+            rotated_sacs = scipy.ndimage.rotate(
+                sacs, angle, axes=(2, 1), reshape=False
+            ).reshape(n_maps, -1)
+            cross_prods = (
+                (flat_sacs * rotated_sacs) @ masks.T
+                - masked_sac_means * (rotated_sacs @ masks.T)
+                - masked_sac_means * sums
+                + np.square(masked_sac_means) * ring_areas
+            ) / ring_areas
+            return cross_prods / variances
+
+        # Only count the CPUs this process may run on, e.g. when restricted
+        # by taskset or a cpuset; sched_getaffinity is not available on macOS.
+        if hasattr(os, "sched_getaffinity"):
+            n_cpus = len(os.sched_getaffinity(0))
+        else:
+            n_cpus = os.cpu_count() or 1
+        n_workers = min(len(self._corr_angles), n_cpus)
+        # The rotations dominate and release the GIL: run the angles in
+        # parallel threads.
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            corrs = dict(
+                zip(
+                    self._corr_angles,
+                    executor.map(correlate, self._corr_angles),
+                    strict=True,
+                )
+            )
+
+        scores_60 = self.grid_score_60(corrs)
+        scores_90 = self.grid_score_90(corrs)
+        max_60_inds = np.argmax(scores_60, axis=1)
+        max_90_inds = np.argmax(scores_90, axis=1)
+        maps = np.arange(n_maps)
+
+        return (
+            scores_60[maps, max_60_inds],
+            scores_90[maps, max_90_inds],
+            [self._masks[ind][1] for ind in max_60_inds],
+            [self._masks[ind][1] for ind in max_90_inds],
+            sacs,
+            max_60_inds,
+        )
+
     def plot_ratemap(self, ratemap, ax=None, title=None, *args, **kwargs):
         """Plot ratemaps."""
         if ax is None:
@@ -1,25 +1,31 @@
 """Generate and load synthetic datasets."""
 
+import itertools
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import pandas as pd
 import skimage
 import torch
+from scipy import sparse
+from scipy.ndimage import gaussian_filter1d
 from torch.distributions.multivariate_normal import MultivariateNormal
-
-from neurometry.estimators.topology.persistent_homology import (
-    cohomological_circular_coordinates,
-    cohomological_toroidal_coordinates,
-)
+from torch.nn import functional as F
 
 os.environ["GEOMSTATS_BACKEND"] = "pytorch"
 import geomstats.backend as gs
 from geomstats.geometry.special_orthogonal import SpecialOrthogonal
 
+# Version of the generation of the images, in the names of the cached
+# datasets: bump it when the generated images change.
+IMAGES_CACHE_VERSION = 2
+
 
-def load_projected_images(n_scalars=5, n_angles=1000, img_size=128):
+def load_projected_images(
+    n_scalars=5, n_angles=1000, img_size=128, device=None, cache_dir=None
+):
     """Load a dataset of 2D images projected into 1D projections.
 
     The actions are:
@@ -32,6 +38,12 @@ def load_projected_images(n_scalars=5, n_angles=1000, img_size=128):
         Number of scalar used for action of scalings.
     n_angles : int
         Number of angles used for action of SO(2).
+    img_size : int
+        Height and width of the images.
+    device : str, optional
+        Torch device used to rotate the images, see load_images.
+    cache_dir : str, optional
+        Directory caching the generated images, see load_images.
 
     Returns
     -------
@@ -41,14 +53,18 @@ def load_projected_images(n_scalars=5, n_angles=1000, img_size=128):
         Labels organized in 2 columns: angles, and scalars.
     """
     images, labels = load_images(
-        n_scalars=n_scalars, n_angles=n_angles, img_size=img_size
+        n_scalars=n_scalars,
+        n_angles=n_angles,
+        img_size=img_size,
+        device=device,
+        cache_dir=cache_dir,
     )
 
     projections = np.sum(images, axis=-1)
     return projections, labels
 
 
-def load_images(n_scalars=10, n_angles=1000, img_size=256):
+def load_images(n_scalars=10, n_angles=1000, img_size=256, device=None, cache_dir=None):
     """Load a dataset of images.
 
     The actions are:
@@ -61,6 +77,15 @@ def load_images(n_scalars=10, n_angles=1000, img_size=256):
         Number of scalar used for action of scalings.
     n_angles : int
         Number of angles used for action of SO(2).
+    img_size : int
+        Height and width of the images.
+    device : str, optional
+        Torch device, e.g. "cuda", used to rotate all images in one batch.
+        If None, images are rotated one at a time with skimage.
+    cache_dir : str, optional
+        Directory where the generated images are saved, and from where
+        they are loaded on later calls with the same parameters.
+        If None, the images are generated at every call.
 
     Returns
     -------
@@ -69,32 +94,140 @@ def load_images(n_scalars=10, n_angles=1000, img_size=256):
     labels : pd.DataFrame, shape=[n_scalars * n_angles, 2]
         Labels organized in 2 columns: angles, and scalars.
     """
+    angles = 360 * np.arange(n_angles) / n_angles
+    scalars = 1 + 0.2 * np.arange(n_scalars)
+    labels = pd.DataFrame(
+        {
+            "angles": np.repeat(angles, n_scalars),
+            "scalars": np.tile(scalars, n_angles),
+        }
+    )
+
+    if cache_dir is not None:
+        cache_path = os.path.join(
+            cache_dir,
+            f"images_v{IMAGES_CACHE_VERSION}_{n_scalars}_{n_angles}_{img_size}.npy",
+        )
+        if os.path.exists(cache_path):
+            logging.info(f"Loading dataset of synthetic images from {cache_path}.")
+            return np.load(cache_path), labels
+
     logging.info("Generating dataset of synthetic images.")
     image = skimage.data.camera()
     image = skimage.transform.resize(image, (img_size, img_size), anti_aliasing=True)
+    # Rotate and blur in float32: the images are stored in float32 anyway.
+    image = image.astype(np.float32)
+
+    if device is not None:
+        rot_images = _rotate_images(image, angles, device)
+
+    def generate_shard(shard):
+        if device is None:
+            shard_rot_images = np.stack(
+                [skimage.transform.rotate(image, angle) for angle in angles[shard]]
+            )
+        else:
+            shard_rot_images = rot_images[shard]
+        _blur_images(shard_rot_images, scalars, images[shard])
+
+    # Rotate and blur shards of consecutive angles in parallel: skimage's
+    # warps and scipy's filters release the GIL, and each shard writes to
+    # its own slice of images.
+    images = np.empty((n_angles, n_scalars, img_size, img_size), dtype=np.float32)
+    # Only count the CPUs this process may run on, e.g. when restricted by
+    # taskset or a cpuset; sched_getaffinity is not available on macOS.
+    if hasattr(os, "sched_getaffinity"):
+        n_cpus = len(os.sched_getaffinity(0))
+    else:
+        n_cpus = os.cpu_count() or 1
+    n_shards = min(n_angles, n_cpus)
+    bounds = np.linspace(0, n_angles, n_shards + 1).astype(int)
+    with ThreadPoolExecutor(max_workers=n_shards) as executor:
+        list(
+            executor.map(
+                generate_shard,
+                [slice(start, end) for start, end in itertools.pairwise(bounds)],
+            )
+        )
+    images = images.reshape((n_angles * n_scalars, img_size, img_size))
 
-    images = []
-    angles = []
-    scalars = []
+    noise = np.empty((img_size, img_size))
     rng = np.random.default_rng(seed=0)
-    for i_angle in range(n_angles):
-        angle = 360 * i_angle / n_angles
-        rot_image = skimage.transform.rotate(image, angle)
-        for i_scalar in range(n_scalars):
-            scalar = 1 + 0.2 * i_scalar
-            blur_image = skimage.filters.gaussian(rot_image, sigma=scalar)
-            noise = rng.normal(loc=0.0, scale=0.05, size=blur_image.shape)
-            images.append((blur_image + noise).astype(np.float32))
-            angles.append(angle)
-            scalars.append(scalar)
+    for one_image in images:
+        rng.standard_normal(out=noise)
+        noise *= 0.05
+        one_image += noise
 
-    labels = pd.DataFrame(
-        {
-            "angles": angles,
-            "scalars": scalars,
-        }
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temporary file first: runs of a sweep may be
+        # reading the cache concurrently.
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, images)
+        os.replace(tmp_path, cache_path)
+    return images, labels
+
+
+def _blur_images(rot_images, scalars, out):
+    """Blur a stack of images with gaussian filters of several widths.
+
+    The 2D gaussian blur is separable: the whole stack is blurred with
+    two 1D passes, along rows then columns, for each scalar.
+
+    Parameters
+    ----------
+    rot_images : array-like, shape=[n_images, img_size, img_size]
+        Images to blur.
+    scalars : array-like, shape=[n_scalars,]
+        Standard deviations of the gaussian filters.
+    out : array-like, shape=[n_images, n_scalars, img_size, img_size]
+        Array in which the blurred images are written.
+    """
+    blur_rows = np.empty_like(rot_images)
+    for i_scalar, scalar in enumerate(scalars):
+        gaussian_filter1d(rot_images, scalar, axis=1, mode="nearest", output=blur_rows)
+        gaussian_filter1d(
+            blur_rows, scalar, axis=2, mode="nearest", output=out[:, i_scalar]
+        )
+
+
+def _rotate_images(image, angles, device):
+    """Rotate a square image by several angles in a single batch.
+
+    The rotations are computed with torch's affine_grid and grid_sample:
+    bilinear interpolation around the image center and zero padding,
+    as in skimage.transform.rotate.
+
+    Parameters
+    ----------
+    image : array-like, shape=[img_size, img_size]
+        Image to rotate.
+    angles : array-like, shape=[n_angles,]
+        Rotation angles, in degrees, counter-clockwise.
+    device : str
+        Torch device on which the rotations are computed.
+
+    Returns
+    -------
+    rot_images : array-like, shape=[n_angles, img_size, img_size]
+        Rotated images.
+    """
+    thetas = torch.deg2rad(torch.as_tensor(angles, device=device))
+    cos, sin = torch.cos(thetas), torch.sin(thetas)
+    zeros = torch.zeros_like(thetas)
+    rotmats = torch.stack(
+        [
+            torch.stack([cos, -sin, zeros], dim=-1),
+            torch.stack([sin, cos, zeros], dim=-1),
+        ],
+        dim=1,
     )
-    return np.array(images), labels
+
+    images = torch.as_tensor(image, device=device).expand(len(angles), 1, *image.shape)
+    grid = F.affine_grid(rotmats.to(images.dtype), images.shape, align_corners=False)
+    rot_images = F.grid_sample(images, grid, align_corners=False)
+    return rot_images[:, 0].cpu().numpy()
 
 
 def load_points(n_scalars=1, n_angles=1000):
@@ -118,35 +251,21 @@ def load_points(n_scalars=1, n_angles=1000):
     labels : pd.DataFrame, shape=[n_scalars * n_angles, 2]
         Labels organized in 2 columns: angles, and scalars.
     """
-    points = []
-    angles = []
-    scalars = []
-    point = np.array([1, 0, 1])
-    for i_angle in range(n_angles):
-        angle = 2 * np.pi * i_angle / n_angles
-        rotmat = np.array(
-            [
-                [np.cos(angle), -np.sin(angle), 0],
-                [np.sin(angle), np.cos(angle), 0],
-                [0, 0, 1.0],
-            ]
-        )
-        rot_point = rotmat @ point
-        for i_scalar in range(n_scalars):
-            scalar = 1 + i_scalar
-            points.append(scalar * rot_point)
+    angles = 2 * np.pi * np.arange(n_angles) / n_angles
+    scalars = 1 + np.arange(n_scalars)
 
-            angles.append(angle)
-            scalars.append(scalar)
+    # Rotations of the point [1, 0, 1] along the z-axis.
+    rot_points = np.stack([np.cos(angles), np.sin(angles), np.ones(n_angles)], axis=1)
+    points = (scalars[None, :, None] * rot_points[:, None, :]).reshape((-1, 3))
 
     labels = pd.DataFrame(
         {
-            "angles": angles,
-            "scalars": scalars,
+            "angles": np.repeat(angles, n_scalars),
+            "scalars": np.tile(scalars, n_angles),
         }
     )
 
-    return np.array(points), labels
+    return points, labels
 
 
 def _create_bump_array(position, width):
@@ -220,7 +339,7 @@ def load_three_place_cells(n_times=360, centers=None, widths=None):
     return place_cells, pd.DataFrame({"angles": labels})
 
 
-def load_place_cells(n_times=10000, n_cells=40):
+def load_place_cells(n_times=10000, n_cells=40, dense=True):
     """Load synthetic place cells.
 
     This is a dataset of synthetic place cell firings, that
@@ -236,56 +355,51 @@ def load_place_cells(n_times=10000, n_cells=40):
         Number of times.
     n_cells : int
         Number of place cells.
+    dense : bool
+        Whether to return the firings as a dense array. Otherwise, they
+        are returned as a sparse CSR matrix: at most 5 cells fire at each
+        time step.
 
     Returns
     -------
-    place_cells : array-like, shape=[n_times, n_cells]
+    place_cells : array-like or scipy.sparse.csr_matrix,
+        shape=[n_times, n_cells]
         Number of firings per time step and per cell.
     labels : pd.DataFrame, shape=[n_times, 1]
         Labels organized in 1 column: angles.
     """
     n_firing_per_cell = int(n_times / n_cells)
-    place_cells = []
-    labels = []
+    n_firings = n_firing_per_cell * n_cells
+
+    # Firing rates of the active cell and of its neighbors on the circle.
+    offsets = np.array([-2, -1, 0, 1, 2])
+    rates = np.array([1.0, 2.0, 4.0, 2.0, 1.0])
+
+    active_cells = np.tile(np.arange(n_cells), n_firing_per_cell)
+    rows = np.repeat(np.arange(n_firings), len(offsets))
+    cols = (active_cells[:, None] + offsets) % n_cells
+
     rng = np.random.default_rng(seed=0)
-    for _ in range(n_firing_per_cell):
-        for i_cell in range(n_cells):
-            cell_firings = np.zeros(n_cells)
-
-            if i_cell == 0:
-                cell_firings[-2] = rng.poisson(1.0)
-                cell_firings[-1] = rng.poisson(2.0)
-                cell_firings[0] = rng.poisson(4.0)
-                cell_firings[1] = rng.poisson(2.0)
-                cell_firings[2] = rng.poisson(1.0)
-            elif i_cell == 1:
-                cell_firings[-1] = rng.poisson(1.0)
-                cell_firings[0] = rng.poisson(2.0)
-                cell_firings[1] = rng.poisson(4.0)
-                cell_firings[2] = rng.poisson(2.0)
-                cell_firings[3] = rng.poisson(1.0)
-            elif i_cell == n_cells - 2:
-                cell_firings[-4] = rng.poisson(1.0)
-                cell_firings[-3] = rng.poisson(2.0)
-                cell_firings[-2] = rng.poisson(4.0)
-                cell_firings[-1] = rng.poisson(2.0)
-                cell_firings[0] = rng.poisson(1.0)
-            elif i_cell == n_cells - 1:
-                cell_firings[-3] = rng.poisson(1.0)
-                cell_firings[-2] = rng.poisson(2.0)
-                cell_firings[-1] = rng.poisson(4.0)
-                cell_firings[0] = rng.poisson(2.0)
-                cell_firings[1] = rng.poisson(1.0)
-            else:
-                cell_firings[i_cell - 2] = rng.poisson(1.0)
-                cell_firings[i_cell - 1] = rng.poisson(2.0)
-                cell_firings[i_cell] = rng.poisson(4.0)
-                cell_firings[i_cell + 1] = rng.poisson(2.0)
-                cell_firings[i_cell - 3] = rng.poisson(1.0)
-            place_cells.append(cell_firings)
-            labels.append(i_cell / n_cells * 360)
-
-    return np.array(place_cells), pd.DataFrame({"angles": labels})
+    firings = rng.poisson(rates, size=(n_firings, len(offsets))).ravel()
+    if n_cells < len(offsets):
+        # The offsets wrap onto the same cells: keep the last firing of each
+        # cell, so that the dense and sparse outputs do not differ, since
+        # the CSR matrix would sum the duplicate entries.
+        later = np.triu(np.ones((len(offsets), len(offsets)), dtype=bool), k=1)
+        overwritten = ((cols[:, :, None] == cols[:, None, :]) & later).any(axis=-1)
+        kept = ~overwritten.ravel()
+        rows, cols, firings = rows[kept], cols.ravel()[kept], firings[kept]
+    cols = cols.ravel()
+    if dense:
+        place_cells = np.zeros((n_firings, n_cells), dtype=np.float32)
+        place_cells[rows, cols] = firings
+    else:
+        place_cells = sparse.csr_matrix(
+            (firings.astype(np.float32), (rows, cols)), shape=(n_firings, n_cells)
+        )
+
+    labels = active_cells / n_cells * 360
+    return place_cells, pd.DataFrame({"angles": labels})
 
 
 def load_s1_synthetic(
@@ -355,6 +469,12 @@ def load_s1_synthetic(
 
     noisy_data = data + radius * noise_dist.sample((n_times,))
 
+    # Imported here: the persistent homology module is not part of the
+    # tree, and the other datasets do not need it.
+    from neurometry.estimators.topology.persistent_homology import (
+        cohomological_circular_coordinates,
+    )
+
     circular_coords = cohomological_circular_coordinates(noisy_data)
 
     labels = pd.DataFrame({"angles": circular_coords})
@@ -441,6 +561,11 @@ def load_t2_synthetic(
 
     noisy_data = data + noise_dist.sample((sqrt_ntimes**2,))
 
+    # Imported here, see load_s1_synthetic.
+    from neurometry.estimators.topology.persistent_homology import (
+        cohomological_toroidal_coordinates,
+    )
+
     toroidal_coords = cohomological_toroidal_coordinates(noisy_data)
 
     labels = pd.DataFrame(
@@ -27,6 +27,7 @@ ray_sweep_dir = os.path.join(work_dir, "results/ray_sweep")
 curvature_profiles_dir = os.path.join(os.getcwd(), "results/curvature_profiles/")
 if not os.path.exists(curvature_profiles_dir):
     os.makedirs(curvature_profiles_dir)
+dataset_cache_dir = os.path.join(work_dir, "results/dataset_cache")
 
 # Hardware
 device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -186,6 +187,11 @@ log_interval = 20
 checkpt_interval = 20
 n_epochs = 600  # 00  # 00  # 50  # 200  # 150  # 240
 sftbeta = 4.5  # beta parameter for softplus
+compile_model = False  # train with a torch.compile'd copy of the model
+# "reduce-overhead" and "max-autotune" replay the compiled fixed-shape
+# forward and backward with CUDA graphs
+compile_mode = "max-autotune"
+autocast_bf16 = False  # run the forward pass of training in bfloat16 on CUDA
 alpha = 1.0  # weight for the reconstruction loss
 beta = 0.03  # 0.03  # weight for KL loss
 gamma = 10  # 20  # weight for latent regularization loss
@@ -39,7 +39,8 @@ class VonMisesFisher(torch.distributions.Distribution):
         self.scale = scale
         self.device = loc.device
         self.__m = loc.shape[-1]
-        self.__e1 = (torch.Tensor([1.0] + [0] * (loc.shape[-1] - 1))).to(self.device)
+        self.__e1 = torch.zeros(self.__m, dtype=self.dtype, device=self.device)
+        self.__e1[0] = 1.0
         self.k = k
 
         super().__init__(self.loc.size(), validate_args=validate_args)
@@ -62,11 +63,10 @@ class VonMisesFisher(torch.distributions.Distribution):
         )
 
         v = (
-            torch.distributions.Normal(0, 1)
-            .sample(shape + torch.Size(self.loc.shape))
-            .to(self.device)
+            torch.randn(shape + self.loc.shape, dtype=self.dtype, device=self.device)
             .transpose(0, -1)[1:]
-        ).transpose(0, -1)
+            .transpose(0, -1)
+        )
         v = v / v.norm(dim=-1, keepdim=True)
 
         w_ = torch.sqrt(torch.clamp(1 - (w**2), 1e-10))
@@ -77,7 +77,7 @@ class VonMisesFisher(torch.distributions.Distribution):
 
     def __sample_w3(self, shape):
         shape = shape + torch.Size(self.scale.shape)
-        u = torch.distributions.Uniform(0, 1).sample(shape).to(self.device)
+        u = torch.rand(shape, dtype=self.dtype, device=self.device)
         self.__w = (
             1
             + torch.stack(
@@ -143,11 +143,8 @@ class VonMisesFisher(torch.distributions.Distribution):
                 .type(self.dtype)
             )
 
-            u = (
-                torch.distributions.Uniform(0 + eps, 1 - eps)
-                .sample(sample_shape)
-                .to(self.device)
-                .type(self.dtype)
+            u = eps + (1 - 2 * eps) * torch.rand(
+                sample_shape, dtype=self.dtype, device=self.device
             )
 
             w_ = (1 - (1 + b) * e_) / (1 - (1 - b) * e_)
@@ -236,6 +236,7 @@ def main_sweep(
         "synthetic_rotation": default_config.synthetic_rotation[dataset_name],
         # Else:
         "device": default_config.device,
+        "dataset_cache_dir": default_config.dataset_cache_dir,
         "log_interval": default_config.log_interval,
         "checkpt_interval": default_config.checkpt_interval,
         "batch_shuffle": default_config.batch_shuffle,
@@ -247,6 +248,9 @@ def main_sweep(
         "gamma_moving": default_config.gamma_moving,
         "gamma_dynamic": default_config.gamma_dynamic,
         "sftbeta": default_config.sftbeta,
+        "compile_model": default_config.compile_model,
+        "compile_mode": default_config.compile_mode,
+        "autocast_bf16": default_config.autocast_bf16,
         "gen_likelihood_type": default_config.gen_likelihood_type,
         "n_grid_points": default_config.n_grid_points,
     }
@@ -410,11 +414,13 @@ def training_plot_log(config, dataset, labels, train_losses, test_losses, model)
     """Plot and log training results."""
     # Plot
     fig_loss = viz.plot_loss(train_losses, test_losses, config)
-    fig_latent = viz.plot_latent_space(model, dataset, labels, config)
-    fig_recon_per_angle = viz.plot_recon_per_positional_angle(
-        model, dataset, labels, config
-    )
-    fig_recon_per_time = viz.plot_recon_per_time(model, dataset, labels, config)
+    # Inference only: do not record the autograd graph of the whole dataset.
+    with torch.no_grad():
+        fig_latent = viz.plot_latent_space(model, dataset, labels, config)
+        fig_recon_per_angle = viz.plot_recon_per_positional_angle(
+            model, dataset, labels, config
+        )
+        fig_recon_per_time = viz.plot_recon_per_time(model, dataset, labels, config)
 
     # Log
     model_path = os.path.join(
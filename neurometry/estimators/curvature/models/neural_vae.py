@@ -4,7 +4,6 @@ This file gathers deep learning models related to G-manifold learning.
 """
 
 import torch
-from torch.distributions.normal import Normal
 from torch.nn import functional as F
 
 from neurometry.estimators.curvature.hyperspherical.distributions.von_mises_fisher import (
@@ -12,6 +11,44 @@ from neurometry.estimators.curvature.hyperspherical.distributions.von_mises_fish
 )
 
 
+def _migrate_linears_state_dict(state_dict, prefix, *args):
+    """Rename the keys of state dicts saved with the former linear layers.
+
+    The layers of encoder_linears and decoder_linears are now interleaved
+    with softplus in encoder_trunk and decoder_trunk: the layer i of the
+    linears is the module 2 * i + 1 of the trunk.
+    """
+    for name in ("encoder", "decoder"):
+        old_prefix = f"{prefix}{name}_linears."
+        for key in [key for key in state_dict if key.startswith(old_prefix)]:
+            i_layer, param = key[len(old_prefix) :].split(".", 1)
+            new_key = f"{prefix}{name}_trunk.{2 * int(i_layer) + 1}.{param}"
+            state_dict[new_key] = state_dict.pop(key)
+
+
+def _fold_linears(model):
+    """Fold the linear layers of a model pickled before the trunks."""
+    for name in ("encoder", "decoder"):
+        linears = model._modules.pop(f"{name}_linears", None)
+        if linears is None:
+            continue
+        layers = [torch.nn.Softplus(beta=model.sftbeta)]
+        for layer in linears:
+            layers += [layer, torch.nn.Softplus(beta=model.sftbeta)]
+        model.add_module(f"{name}_trunk", torch.nn.Sequential(*layers))
+        model._register_load_state_dict_pre_hook(_migrate_linears_state_dict)
+
+
+def _no_autocast(tensor):
+    """Return a context disabling autocast on the device of tensor.
+
+    Only the trunks of the VAEs run under autocast: the posterior heads,
+    the sampling of the latents and the output head, hence the losses,
+    run in the dtype of the model.
+    """
+    return torch.autocast(tensor.device.type, enabled=False)
+
+
 class NeuralVAE(torch.nn.Module):
     """VAE with Linear (fully connected) layers.
 
@@ -48,12 +85,13 @@ class NeuralVAE(torch.nn.Module):
         decoder_depth = encoder_depth
 
         self.encoder_fc = torch.nn.Linear(self.data_dim, encoder_width)
-        self.encoder_linears = torch.nn.ModuleList(
-            [
-                torch.nn.Linear(encoder_width, encoder_width)
-                for _ in range(encoder_depth)
+        encoder_layers = [torch.nn.Softplus(beta=self.sftbeta)]
+        for _ in range(encoder_depth):
+            encoder_layers += [
+                torch.nn.Linear(encoder_width, encoder_width),
+                torch.nn.Softplus(beta=self.sftbeta),
             ]
-        )
+        self.encoder_trunk = torch.nn.Sequential(*encoder_layers)
 
         if posterior_type == "gaussian":
             self.fc_z_mu = torch.nn.Linear(encoder_width, self.latent_dim)
@@ -63,17 +101,24 @@ class NeuralVAE(torch.nn.Module):
             self.fc_z_logvar = torch.nn.Linear(encoder_width, 1)  # kappa
 
         self.decoder_fc = torch.nn.Linear(self.latent_dim, decoder_width)
-        self.decoder_linears = torch.nn.ModuleList(
-            [
-                torch.nn.Linear(decoder_width, decoder_width)
-                for _ in range(decoder_depth)
+        decoder_layers = [torch.nn.Softplus(beta=self.sftbeta)]
+        for _ in range(decoder_depth):
+            decoder_layers += [
+                torch.nn.Linear(decoder_width, decoder_width),
+                torch.nn.Softplus(beta=self.sftbeta),
             ]
-        )
+        self.decoder_trunk = torch.nn.Sequential(*decoder_layers)
 
         self.fc_x_mu = torch.nn.Linear(decoder_width, self.data_dim)
+        self._register_load_state_dict_pre_hook(_migrate_linears_state_dict)
 
         self.drop_out = torch.nn.Dropout(p=self.drop_out_p)
 
+    def __setstate__(self, state):
+        """Restore a pickled model, folding the layers of older models."""
+        super().__setstate__(state)
+        _fold_linears(self)
+
     def encode(self, x):
         """Encode input into mean and log-variance.
 
@@ -95,21 +140,19 @@ class NeuralVAE(torch.nn.Module):
             Vector representing the diagonal covariance of the
             multivariate Gaussian in latent space.
         """
-        h = F.softplus(self.encoder_fc(x.double()), beta=self.sftbeta)
-
-        for _i_layer, layer in enumerate(self.encoder_linears):
-            # h = self.drop_out(h)
-            h = layer(h)
-            h = F.softplus(h, beta=self.sftbeta)
-
-        if self.posterior_type == "gaussian":
-            z_mu = self.fc_z_mu(h)
-            z_logvar = self.fc_z_logvar(h)
-            posterior_params = z_mu, z_logvar
-        elif self.posterior_type == "hyperspherical":
-            z_mu = self.fc_z_mu(h)
-            z_kappa = F.softplus(self.fc_z_logvar(h)) + 1
-            posterior_params = z_mu, z_kappa
+        dtype = self.fc_z_mu.weight.dtype
+        h = self.encoder_trunk(self.encoder_fc(x.to(dtype)))
+
+        with _no_autocast(h):
+            h = h.to(dtype)
+            if self.posterior_type == "gaussian":
+                z_mu = self.fc_z_mu(h)
+                z_logvar = self.fc_z_logvar(h)
+                posterior_params = z_mu, z_logvar
+            elif self.posterior_type == "hyperspherical":
+                z_mu = self.fc_z_mu(h)
+                z_kappa = F.softplus(self.fc_z_logvar(h)) + 1
+                posterior_params = z_mu, z_kappa
 
         return posterior_params
 
@@ -135,12 +178,12 @@ class NeuralVAE(torch.nn.Module):
         if self.posterior_type == "gaussian":
             z_mu, z_logvar = posterior_params
             z_std = torch.exp(0.5 * z_logvar)
-            q_z = Normal(z_mu, z_std)
+            z = z_mu + z_std * torch.randn_like(z_std)
         elif self.posterior_type == "hyperspherical":
             z_mu, z_kappa = posterior_params
-            q_z = VonMisesFisher(z_mu, z_kappa)
+            z = VonMisesFisher(z_mu, z_kappa).rsample()
 
-        return q_z.rsample()
+        return z
 
     def decode(self, z):
         """Decode latent variable z into data.
@@ -156,14 +199,10 @@ class NeuralVAE(torch.nn.Module):
             Reconstructed data corresponding to z.
         """
 
-        h = F.softplus(self.decoder_fc(z), beta=self.sftbeta)
-
-        for _i_layer, layer in enumerate(self.decoder_linears):
-            # h = self.drop_out(h)
-            h = layer(h)
-            h = F.softplus(h, beta=self.sftbeta)
+        h = self.decoder_trunk(self.decoder_fc(z))
 
-        return self.fc_x_mu(h)
+        with _no_autocast(h):
+            return self.fc_x_mu(h.to(self.fc_x_mu.weight.dtype))
 
     def forward(self, x):
         """Run VAE: Encode, sample and decode.
@@ -185,6 +224,7 @@ class NeuralVAE(torch.nn.Module):
         """
 
         posterior_params = self.encode(x)
-        z = self.reparameterize(posterior_params)
+        with _no_autocast(x):
+            z = self.reparameterize(posterior_params)
         x_mu = self.decode(z)
         return z, x_mu, posterior_params
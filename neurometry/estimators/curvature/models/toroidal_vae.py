@@ -10,6 +10,11 @@ from torch.nn import functional as F
 from neurometry.estimators.curvature.hyperspherical.distributions.von_mises_fisher import (
     VonMisesFisher,
 )
+from neurometry.estimators.curvature.models.neural_vae import (
+    _fold_linears,
+    _migrate_linears_state_dict,
+    _no_autocast,
+)
 
 
 class ToroidalVAE(torch.nn.Module):
@@ -46,12 +51,13 @@ class ToroidalVAE(torch.nn.Module):
         # decoder_depth = encoder_depth
 
         self.encoder_fc = torch.nn.Linear(self.data_dim, encoder_width)
-        self.encoder_linears = torch.nn.ModuleList(
-            [
-                torch.nn.Linear(encoder_width, encoder_width)
-                for _ in range(encoder_depth)
+        encoder_layers = [torch.nn.Softplus(beta=self.sftbeta)]
+        for _ in range(encoder_depth):
+            encoder_layers += [
+                torch.nn.Linear(encoder_width, encoder_width),
+                torch.nn.Softplus(beta=self.sftbeta),
             ]
-        )
+        self.encoder_trunk = torch.nn.Sequential(*encoder_layers)
 
         self.fc_z_theta_mu = torch.nn.Linear(encoder_width, self.latent_dim)
         self.fc_z_theta_kappa = torch.nn.Linear(encoder_width, 1)
@@ -60,14 +66,21 @@ class ToroidalVAE(torch.nn.Module):
         self.fc_z_phi_kappa = torch.nn.Linear(encoder_width, 1)
 
         self.decoder_fc = torch.nn.Linear(3, decoder_width)
-        self.decoder_linears = torch.nn.ModuleList(
-            [
-                torch.nn.Linear(decoder_width, decoder_width)
-                for _ in range(decoder_depth)
+        decoder_layers = [torch.nn.Softplus(beta=self.sftbeta)]
+        for _ in range(decoder_depth):
+            decoder_layers += [
+                torch.nn.Linear(decoder_width, decoder_width),
+                torch.nn.Softplus(beta=self.sftbeta),
             ]
-        )
+        self.decoder_trunk = torch.nn.Sequential(*decoder_layers)
 
         self.fc_x_mu = torch.nn.Linear(decoder_width, self.data_dim)
+        self._register_load_state_dict_pre_hook(_migrate_linears_state_dict)
+
+    def __setstate__(self, state):
+        """Restore a pickled model, folding the layers of older models."""
+        super().__setstate__(state)
+        _fold_linears(self)
 
     def encode(self, x):
         """Encode input into mean and log-variance.
@@ -90,16 +103,15 @@ class ToroidalVAE(torch.nn.Module):
             Vector representing the diagonal covariance of the
             multivariate Gaussian in latent space.
         """
-        h = F.softplus(self.encoder_fc(x), beta=self.sftbeta)
+        h = self.encoder_trunk(self.encoder_fc(x))
 
-        for layer in self.encoder_linears:
-            h = F.softplus(layer(h), beta=self.sftbeta)
+        with _no_autocast(h):
+            h = h.to(self.fc_z_theta_mu.weight.dtype)
+            z_theta_mu = self.fc_z_theta_mu(h)
+            z_theta_kappa = F.softplus(self.fc_z_theta_kappa(h)) + 1
 
-        z_theta_mu = self.fc_z_theta_mu(h)
-        z_theta_kappa = F.softplus(self.fc_z_theta_kappa(h)) + 1
-
-        z_phi_mu = self.fc_z_phi_mu(h)
-        z_phi_kappa = F.softplus(self.fc_z_phi_kappa(h)) + 1
+            z_phi_mu = self.fc_z_phi_mu(h)
+            z_phi_kappa = F.softplus(self.fc_z_phi_kappa(h)) + 1
 
         return z_theta_mu, z_theta_kappa, z_phi_mu, z_phi_kappa
 
@@ -166,12 +178,10 @@ class ToroidalVAE(torch.nn.Module):
             Reconstructed data corresponding to z.
         """
 
-        h = F.softplus(self.decoder_fc(z), beta=self.sftbeta)
-
-        for layer in self.decoder_linears:
-            h = F.softplus(layer(h), beta=self.sftbeta)
+        h = self.decoder_trunk(self.decoder_fc(z))
 
-        return self.fc_x_mu(h)
+        with _no_autocast(h):
+            return self.fc_x_mu(h.to(self.fc_x_mu.weight.dtype))
 
     def forward(self, x):
         """Run VAE: Encode, sample and decode.
@@ -194,7 +204,8 @@ class ToroidalVAE(torch.nn.Module):
 
         posterior_params = self.encode(x)
 
-        z = self.reparameterize(posterior_params)
+        with _no_autocast(x):
+            z = self.reparameterize(posterior_params)
 
         x_mu = self.decode(z)
 
@@ -12,10 +12,18 @@ def train_test(model, train_loader, test_loader, optimizer, scheduler, config):
     train_losses = []
     test_losses = []
     lowest_test_loss = 1000
+    # The compiled module shares its parameters with model, which is kept
+    # uncompiled so that it can be deep-copied and saved.
+    # Configs rebuilt from the json files of earlier runs lack these keys.
+    train_model = model
+    if getattr(config, "compile_model", False):
+        train_model = torch.compile(
+            model, mode=getattr(config, "compile_mode", "default")
+        )
     for epoch in range(1, config.n_epochs + 1):
         train_loss = train_one_epoch(
             epoch=epoch,
-            model=model,
+            model=train_model,
             train_loader=train_loader,
             optimizer=optimizer,
             config=config,
@@ -23,7 +31,7 @@ def train_test(model, train_loader, test_loader, optimizer, scheduler, config):
         train_losses.append(train_loss)
 
         test_loss = test_one_epoch(
-            epoch=epoch, model=model, test_loader=test_loader, config=config
+            epoch=epoch, model=train_model, test_loader=test_loader, config=config
         )
 
         if config.scheduler == "True":
@@ -38,6 +46,33 @@ def train_test(model, train_loader, test_loader, optimizer, scheduler, config):
     return train_losses, test_losses, best_model
 
 
+def _autocast(config):
+    """Return the autocast context of the forward pass.
+
+    The forward pass of the model runs in this context, but the models
+    only run their encoder and decoder trunks in bfloat16: the posterior
+    heads, the sampling of the latents and the output head disable
+    autocast and run in the dtype of the model, as do the losses, in
+    particular the KL term. Autocast leaves float64 models untouched.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration, with the flag autocast_bf16, off if missing.
+
+    Returns
+    -------
+    autocast : torch.autocast
+        Autocast context, enabled on CUDA devices only.
+    """
+    device_type = torch.device(config.device).type
+    return torch.autocast(
+        device_type=device_type,
+        dtype=torch.bfloat16,
+        enabled=getattr(config, "autocast_bf16", False) and device_type == "cuda",
+    )
+
+
 def train_one_epoch(epoch, model, train_loader, optimizer, config):
     """Run one epoch on the train set.
 
@@ -59,7 +94,8 @@ def train_one_epoch(epoch, model, train_loader, optimizer, config):
         data = data.to(config.device)
         labels = labels.to(config.device)
         optimizer.zero_grad()
-        z_batch, x_mu_batch, posterior_params = model(data)
+        with _autocast(config):
+            z_batch, x_mu_batch, posterior_params = model(data)
 
         elbo_loss, recon_loss, kld, latent_loss, moving_forward_loss = losses.elbo(
             data, x_mu_batch, posterior_params, z_batch, labels, config
@@ -114,7 +150,8 @@ def test_one_epoch(epoch, model, test_loader, config):
             data = data.to(config.device)
             labels = labels.float()
             labels = labels.to(config.device)
-            z_batch, x_mu_batch, posterior_params = model(data)
+            with _autocast(config):
+                z_batch, x_mu_batch, posterior_params = model(data)
 
             elbo_loss, recon_loss, kld, latent_loss, moving_forward_loss = losses.elbo(
                 data, x_mu_batch, posterior_params, z_batch, labels, config
@@ -0,0 +1,35 @@
+import numpy as np
+import torch
+
+from neurometry.datasets.piRNNs.dual_agent.visualize import _bin_activations, rgb
+
+
+def test_bin_activations():
+    res = 5
+    rng = np.random.default_rng(0)
+    # Some of the samples fall outside of the grid, on every side.
+    x_bins = rng.integers(-2, res + 2, size=200)
+    y_bins = rng.integers(-2, res + 2, size=200)
+    g_batch = rng.standard_normal((200, 3)).astype(np.float32)
+
+    counts, activations = _bin_activations(
+        torch.as_tensor(x_bins), torch.as_tensor(y_bins), torch.as_tensor(g_batch), res
+    )
+
+    expected_counts = np.zeros((res, res))
+    expected_activations = np.zeros((3, res, res))
+    for x, y, g in zip(x_bins, y_bins, g_batch, strict=True):
+        if 0 <= x < res and 0 <= y < res:
+            expected_counts[x, y] += 1
+            expected_activations[:, x, y] += g
+    assert np.array_equal(counts.numpy(), expected_counts)
+    assert np.allclose(activations.numpy(), expected_activations)
+
+
+def test_rgb_integer_image():
+    image = np.arange(16).reshape(4, 4)
+    colors = rgb(image, smooth=False)
+    assert colors.shape == (4, 4, 4)
+    assert colors.dtype == np.uint8
+    assert np.array_equal(colors, rgb(image.astype(float), smooth=False))
+    assert np.array_equal(rgb(image), rgb(image.astype(float)))
@@ -0,0 +1,81 @@
+import numpy as np
+
+from neurometry.datasets.piRNNs.scores import GridScorer
+
+
+def _make_scorer(nbins):
+    starts = [0.1] * 20
+    ends = np.linspace(0.2, 1.4, num=20)
+    return GridScorer(nbins, ((0, 1), (0, 1)), zip(starts, ends.tolist(), strict=False))
+
+
+def _make_rate_maps(nbins):
+    rng = np.random.default_rng(0)
+    xs, ys = np.meshgrid(np.arange(nbins), np.arange(nbins), indexing="ij")
+    rate_maps = [rng.random((nbins, nbins)) for _ in range(3)]
+    for _ in range(4):
+        theta = rng.random() * np.pi / 3
+        freq = 0.2 + 0.4 * rng.random()
+        grid = sum(
+            np.cos(freq * (np.cos(theta + t) * xs + np.sin(theta + t) * ys))
+            for t in (0, np.pi / 3, 2 * np.pi / 3)
+        )
+        rate_maps.append(grid + 0.1 * rng.standard_normal((nbins, nbins)))
+    rate_maps.append(np.full((nbins, nbins), 3.0))
+    rate_maps.append(np.zeros((nbins, nbins)))
+    return np.stack(rate_maps)
+
+
+def test_get_scores_batch():
+    nbins = 20
+    scorer = _make_scorer(nbins)
+    rate_maps = _make_rate_maps(nbins)
+
+    (
+        scores_60,
+        scores_90,
+        masks_60,
+        masks_90,
+        sacs,
+        max_60_inds,
+    ) = scorer.get_scores_batch(rate_maps)
+
+    for i, rate_map in enumerate(rate_maps):
+        score_60, score_90, mask_60, mask_90, sac, max_60_ind = scorer.get_scores(
+            rate_map.copy()
+        )
+        assert np.allclose(sacs[i], sac, atol=1e-5)
+        assert np.isclose(scores_60[i], score_60, atol=1e-5)
+        assert np.isclose(scores_90[i], score_90, atol=1e-5)
+        assert masks_60[i] == mask_60
+        assert masks_90[i] == mask_90
+        assert max_60_inds[i] == max_60_ind
+
+
+def test_get_scores_batch_constant_maps():
+    nbins = 20
+    scorer = _make_scorer(nbins)
+    rate_maps = np.stack([np.full((nbins, nbins), 2.0), np.zeros((nbins, nbins))])
+
+    scores_60, scores_90, _, _, sacs, _ = scorer.get_scores_batch(rate_maps)
+
+    assert np.allclose(sacs, 0.0)
+    assert np.allclose(scores_60, 0.0)
+    assert np.allclose(scores_90, 0.0)
+
+
+def test_get_scores_batch_offset_invariance():
+    """The direct per-map computation loses small variations to a large
+    offset, so the batched scores are compared to the centered maps."""
+    nbins = 20
+    scorer = _make_scorer(nbins)
+    rate_maps = _make_rate_maps(nbins)[3:7]
+
+    scores_60, scores_90, _, _, sacs, _ = scorer.get_scores_batch(rate_maps)
+    offset_scores_60, offset_scores_90, _, _, offset_sacs, _ = scorer.get_scores_batch(
+        1.0 + 1e-5 * rate_maps
+    )
+
+    assert np.allclose(offset_sacs, sacs, atol=1e-5)
+    assert np.allclose(offset_scores_60, scores_60, atol=1e-5)
+    assert np.allclose(offset_scores_90, scores_90, atol=1e-5)
@@ -0,0 +1,68 @@
+import pickle
+
+import torch
+
+from neurometry.estimators.curvature.models.neural_vae import NeuralVAE
+
+
+def _to_linears_state_dict(state_dict):
+    """Rename the keys of a state dict to the former layout of the layers."""
+    old_state_dict = {}
+    for key, value in state_dict.items():
+        name, _, rest = key.partition("_trunk.")
+        if rest:
+            i_module, param = rest.split(".", 1)
+            key = f"{name}_linears.{(int(i_module) - 1) // 2}.{param}"
+        old_state_dict[key] = value
+    return old_state_dict
+
+
+def test_neural_vae_loads_linears_state_dict():
+    torch.manual_seed(0)
+    model = NeuralVAE(5, 2, 4.5, encoder_width=8, encoder_depth=3).double()
+    old_state_dict = _to_linears_state_dict(model.state_dict())
+    assert "encoder_linears.2.weight" in old_state_dict
+
+    new_model = NeuralVAE(5, 2, 4.5, encoder_width=8, encoder_depth=3).double()
+    new_model.load_state_dict(old_state_dict)
+
+    x = torch.randn(4, 5, dtype=torch.float64)
+    z_mu, _ = model.encode(x)
+    new_z_mu, _ = new_model.encode(x)
+    assert torch.allclose(new_z_mu, z_mu)
+    assert torch.allclose(new_model.decode(z_mu), model.decode(z_mu))
+
+
+def test_neural_vae_unpickles_linears():
+    torch.manual_seed(0)
+    model = NeuralVAE(5, 2, 4.5, encoder_width=8, encoder_depth=2).double()
+    x = torch.randn(4, 5, dtype=torch.float64)
+    z_mu, _ = model.encode(x)
+    x_mu = model.decode(z_mu)
+
+    # Rebuild the modules of a model pickled with the former layout.
+    for name in ("encoder", "decoder"):
+        trunk = model._modules.pop(f"{name}_trunk")
+        model.add_module(f"{name}_linears", torch.nn.ModuleList(trunk[1::2]))
+    model = pickle.loads(pickle.dumps(model))
+
+    assert not hasattr(model, "encoder_linears")
+    new_z_mu, _ = model.encode(x)
+    assert torch.allclose(new_z_mu, z_mu)
+    assert torch.allclose(model.decode(z_mu), x_mu)
+
+
+def test_neural_vae_autocast_heads():
+    torch.manual_seed(0)
+    model = NeuralVAE(5, 2, 4.5, encoder_width=8, encoder_depth=2).float()
+    x = torch.randn(4, 5, dtype=torch.float32)
+
+    with torch.autocast("cpu", dtype=torch.bfloat16):
+        h = model.encoder_trunk(model.encoder_fc(x))
+        z, x_mu, posterior_params = model(x)
+
+    # Only the trunks run in bfloat16.
+    assert h.dtype == torch.bfloat16
+    assert z.dtype == torch.float32
+    assert x_mu.dtype == torch.float32
+    assert all(param.dtype == torch.float32 for param in posterior_params)
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import skimage
+
+from neurometry.estimators.curvature.datasets.synthetic import (
+    _blur_images,
+    _rotate_images,
+    load_images,
+    load_place_cells,
+)
+
+
+def _load_images_reference(n_scalars, n_angles, img_size):
+    """Generate the images one at a time, with skimage."""
+    image = skimage.data.camera()
+    image = skimage.transform.resize(image, (img_size, img_size), anti_aliasing=True)
+
+    images = []
+    angles = []
+    scalars = []
+    rng = np.random.default_rng(seed=0)
+    for i_angle in range(n_angles):
+        angle = 360 * i_angle / n_angles
+        rot_image = skimage.transform.rotate(image, angle)
+        for i_scalar in range(n_scalars):
+            scalar = 1 + 0.2 * i_scalar
+            blur_image = skimage.filters.gaussian(rot_image, sigma=scalar)
+            noise = rng.normal(loc=0.0, scale=0.05, size=blur_image.shape)
+            images.append((blur_image + noise).astype(np.float32))
+            angles.append(angle)
+            scalars.append(scalar)
+
+    labels = pd.DataFrame({"angles": angles, "scalars": scalars})
+    return np.array(images), labels
+
+
+def test_rotate_images():
+    image = skimage.transform.resize(
+        skimage.data.camera(), (32, 32), anti_aliasing=True
+    )
+    angles = np.array([0.0, 30.0, 90.0, 137.5, 200.0, 359.0])
+
+    rot_images = _rotate_images(image, angles, "cpu")
+
+    expected = np.stack([skimage.transform.rotate(image, angle) for angle in angles])
+    assert rot_images.shape == expected.shape
+    assert np.allclose(rot_images, expected, rtol=0, atol=1e-14)
+
+
+def test_blur_images():
+    rng = np.random.default_rng(0)
+    rot_images = rng.random((4, 16, 16))
+    scalars = np.array([1.0, 1.2, 1.4])
+
+    out = np.empty((4, 3, 16, 16))
+    _blur_images(rot_images, scalars, out)
+
+    expected = np.stack(
+        [
+            [skimage.filters.gaussian(image, sigma=scalar) for scalar in scalars]
+            for image in rot_images
+        ]
+    )
+    assert np.allclose(out, expected, rtol=0, atol=1e-14)
+
+
+def test_load_images():
+    kwargs = {"n_scalars": 3, "n_angles": 7, "img_size": 32}
+    expected_images, expected_labels = _load_images_reference(**kwargs)
+
+    images, labels = load_images(**kwargs)
+    assert images.dtype == np.float32
+    assert np.allclose(images, expected_images, rtol=0, atol=1e-6)
+    assert np.allclose(labels.values, expected_labels.values)
+
+    images, _ = load_images(device="cpu", **kwargs)
+    assert np.allclose(images, expected_images, rtol=0, atol=1e-6)
+
+
+def test_load_images_cache(tmp_path):
+    kwargs = {"n_scalars": 2, "n_angles": 5, "img_size": 16}
+    images, labels = load_images(cache_dir=str(tmp_path), **kwargs)
+    cached_images, cached_labels = load_images(cache_dir=str(tmp_path), **kwargs)
+
+    assert np.array_equal(cached_images, images)
+    assert cached_labels.equals(labels)
+    assert cached_images.flags.writeable
+
+
+def test_load_place_cells_sparse():
+    # With fewer than 5 cells, the neighbors wrap onto the same cells.
+    for n_cells in [3, 4, 40]:
+        place_cells, labels = load_place_cells(n_times=200, n_cells=n_cells)
+        sparse_place_cells, sparse_labels = load_place_cells(
+            n_times=200, n_cells=n_cells, dense=False
+        )
+        assert np.array_equal(sparse_place_cells.toarray(), place_cells)
+        assert sparse_labels.equals(labels)